@@ -8,12 +8,21 @@ Created on Mon 21 March 2022
 """
 from flask import Blueprint
 from flask_restx import Resource, Api, fields, reqparse
-from helpers import add_new_actor, get_all_actors_paginated, get_actor, delete_actor, update_actor, get_stat_summary
+from compression import compress_response
+from profiling import start_profiling, stop_profiling
+from helpers import add_new_actor, get_all_actors_paginated, get_actor, delete_actor, update_actor, get_stat_summary, get_changes
 
 
 # ----- API IMPLEMENTATION ------
 api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
 
+# Compressing large responses according to the client's Accept-Encoding
+api_bp.after_request(compress_response)
+
+# Profiling requests selected by the PROFILE_* settings
+api_bp.before_request(start_profiling)
+api_bp.teardown_request(stop_profiling)
+
 api = Api(api_bp,
           default = 'Actors',
           title = 'API for Actors',
@@ -38,6 +47,15 @@ list_parser.add_argument('order', action = 'split', default = ['+id'])
 list_parser.add_argument('page', type = int, default = 1)
 list_parser.add_argument('size', type = int, default = 10)
 list_parser.add_argument('filter', action = 'split',  default = ['id','name'])
+list_parser.add_argument('country')
+list_parser.add_argument('gender')
+list_parser.add_argument('born_from', type = int)
+list_parser.add_argument('born_to', type = int)
+list_parser.add_argument('life_status', choices = ['alive', 'deceased'])
+
+changes_parser = reqparse.RequestParser()
+changes_parser.add_argument('since', type = int, default = 0)
+changes_parser.add_argument('limit', type = int, default = 100)
 
 stat_parser = reqparse.RequestParser()
 stat_parser.add_argument('format', choices = ['json', 'image'], required = True)
@@ -66,7 +84,12 @@ class ActorsList(Resource):
              params = {'order': 'Criteria to sort the list of actors\n(Criteria: id, name, country, birthday, deathday, last-update)\n(Prefix: + for ascending order, - for descending order)',\
                        'page': 'Page number to display',\
                        'size': 'Number of actors on a page',\
-                       'filter': 'Attributes to display for each actor\n(Attributes: id, name, country, birthday, deathday, last-update, shows)'})
+                       'filter': 'Attributes to display for each actor\n(Attributes: id, name, country, birthday, deathday, last-update, shows)',\
+                       'country': 'Only list actors from this country, case-insensitive (e.g. Japan)',\
+                       'gender': 'Only list actors of this gender, case-insensitive (e.g. Male, Female)',\
+                       'born_from': 'Only list actors born in or after this year',\
+                       'born_to': 'Only list actors born in or before this year',\
+                       'life_status': 'Only list actors who are alive or deceased'})
     @api.expect(list_parser, validate = True)    
     def get(self):
         # Retrieving the query parameters
@@ -75,7 +98,8 @@ class ActorsList(Resource):
         input_page = args.get('page')
         input_size = args.get('size')
         input_filter = args.get('filter')
-        return get_all_actors_paginated(input_order, input_page, input_size, input_filter)
+        input_facets = {key: args.get(key) for key in ['country', 'gender', 'born_from', 'born_to', 'life_status']}
+        return get_all_actors_paginated(input_order, input_page, input_size, input_filter, input_facets)
         
         
 @api.route('/actors/<int:id>')
@@ -137,3 +161,21 @@ class ActorsStat(Resource):
         return get_stat_summary(input_format, input_attributes)
         
         
+
+
+# Q7 - Get the Changes of Actors for Incremental Sync
+@api.route('/actors/changes')
+class ActorsChanges(Resource):
+    
+    @api.response(200, 'Successful')
+    @api.response(400, 'Parameter Validation Error')
+    @api.doc(description = 'Get Actor Changes After a Sequence Number',\
+             params = {'since': 'Sequence number of the last change already synced (0 to start from the beginning)',\
+                       'limit': 'Maximum number of changes to return (1-1000)'})
+    @api.expect(changes_parser, validate = True)
+    def get(self):
+        # Retrieving the query parameters
+        args = changes_parser.parse_args()
+        input_since = args.get('since')
+        input_limit = args.get('limit')
+        return get_changes(input_since, input_limit)
@@ -40,9 +40,45 @@ def create_tables():
                 ON UPDATE NO ACTION
             );'''
     
+    # Append-only log of actor changes used by the change feed
+    # (no foreign key so that delete events outlive the deleted actor)
+    changes_table = '''CREATE TABLE IF NOT EXISTS ActorChanges (
+            seq             INTEGER PRIMARY KEY AUTOINCREMENT,
+            actor_id        INTEGER NOT NULL,
+            op              TEXT NOT NULL,
+            changedAt       TEXT
+            );'''
+    
+    changes_index = '''CREATE INDEX IF NOT EXISTS idx_changes_actor_seq
+            ON ActorChanges (actor_id, seq);'''
+    
+    # Logging actors added before the change log existed, so that a sync
+    # from the beginning of the feed sees every actor
+    changes_backfill = '''INSERT INTO ActorChanges (actor_id, op, changedAt)
+            SELECT id, 'upsert', lastUpdate FROM Actors
+            WHERE id NOT IN (SELECT actor_id FROM ActorChanges)
+            ORDER BY id;'''
+    
+    # Composite indexes supporting the row filters of the actor list
+    # (birthday and deathday are 'YYYY-MM-DD' or 'NULL', so they compare as text;
+    # country and gender are matched case-insensitively)
+    actors_indexes = ['''CREATE INDEX IF NOT EXISTS idx_actors_country
+            ON Actors (country COLLATE NOCASE, deathday, gender COLLATE NOCASE);''',
+            '''CREATE INDEX IF NOT EXISTS idx_actors_gender
+            ON Actors (gender COLLATE NOCASE, birthday);''',
+            '''CREATE INDEX IF NOT EXISTS idx_actors_birthday
+            ON Actors (birthday);''',
+            '''CREATE INDEX IF NOT EXISTS idx_actors_deathday
+            ON Actors (deathday, birthday);''']
+    
     try:
         conn.execute(actors_table)
         conn.execute(shows_table)
+        conn.execute(changes_table)
+        conn.execute(changes_index)
+        conn.execute(changes_backfill)
+        for actors_index in actors_indexes:
+            conn.execute(actors_index)
         conn.commit()
         print('Tables are created successfully')
         
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Python 3.8.5
+"""
+
+Negotiated response compression (brotli, gzip, deflate) for the API blueprint
+
+Bodies are compressed incrementally while they are sent, chunk by chunk,
+instead of building a second compressed copy of the whole body. Settings
+are read from the app config:
+    COMPRESS_MIN_SIZE   Smallest body (bytes) worth compressing (default: 1024)
+    COMPRESS_LEVEL      zlib level used for gzip/deflate (default: 6)
+    COMPRESS_BR_LEVEL   Brotli quality (default: 4)
+
+"""
+import zlib
+from flask import request, current_app
+
+# Brotli is optional and only offered when the package is installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+# ----- COMPRESSION HELPER FUNCTIONS ------
+def iter_chunks(body):
+    # Splitting the body into chunks without copying it
+    for data in body:
+        view = memoryview(data)
+        for start in range(0, len(view), CHUNK_SIZE):
+            yield view[start : start + CHUNK_SIZE]
+
+
+def compress_chunks(chunks, encoding, level):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality = level)
+        for chunk in chunks:
+            data = compressor.process(bytes(chunk))
+            if data:
+                yield data
+        yield compressor.finish()
+
+    else:
+        # wbits 31 writes a gzip container, 15 a zlib stream (HTTP deflate)
+        wbits = 31 if encoding == 'gzip' else 15
+        compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def compress_response(response):
+    # Skipping bodies that are empty, already encoded, images or sent from files
+    if request.method == 'HEAD' \
+            or response.status_code < 200 or response.status_code in (204, 304) \
+            or response.direct_passthrough \
+            or 'Content-Encoding' in response.headers \
+            or response.mimetype.startswith('image/'):
+        return response
+
+    # Skipping small bodies (streamed bodies have no known length)
+    content_length = response.calculate_content_length()
+    if content_length is not None and content_length < current_app.config.get('COMPRESS_MIN_SIZE', 1024):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    # Negotiating the encoding, preferring brotli when available
+    encodings = ['br', 'gzip', 'deflate'] if brotli else ['gzip', 'deflate']
+    encoding = request.accept_encodings.best_match(encodings)
+    if encoding is None:
+        return response
+
+    if encoding == 'br':
+        level = current_app.config.get('COMPRESS_BR_LEVEL', 4)
+    else:
+        level = current_app.config.get('COMPRESS_LEVEL', 6)
+
+    response.response = compress_chunks(iter_chunks(response.iter_encoded()), encoding, level)
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Content-Length', None)
+    return response
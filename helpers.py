@@ -6,15 +6,18 @@ This program was written by Vu Ho
 Created on Mon 21 March 2022
 
 """
-import re
 import sqlite3
 from pandas.io import sql
 import requests
 from flask import request, send_file
 from datetime import datetime, timedelta
 from math import ceil
-import matplotlib.pyplot as plt
+from urllib.parse import urlencode
+from io import BytesIO
+from matplotlib import cm
+from matplotlib.figure import Figure
 from actors_db import connect_db
+from tvmaze_index import normalise_name, lookup_person
 
 
 # ----- DATABASE HELPER FUNCTIONS ------
@@ -26,6 +29,10 @@ def add_actor(actor, showlist, conn):
                      actor['deathday'], actor['gender'], actor['lastUpdate']))
         actor_db_id = cur.lastrowid
         
+        # Logging the insertion in the change feed (skipped if the row was ignored)
+        if cur.rowcount == 1:
+            record_change(actor_db_id, 'upsert', cur)
+        
         # If the list of shows is not empty
         if showlist:
             for show in showlist:
@@ -44,6 +51,62 @@ def add_actor(actor, showlist, conn):
     return actor_db_id
 
 
+def record_change(actor_id, op, cur):
+    # Appending an event (op is 'upsert' or 'delete') to the change log
+    # within the caller's transaction
+    now = datetime.now().strftime('%Y-%m-%d-%H:%M:%S')
+    cur.execute("INSERT INTO ActorChanges (actor_id, op, changedAt) VALUES (?, ?, ?)",\
+                (actor_id, op, now))
+
+
+def get_changes_since(since, limit, conn):
+    # Getting the latest event of each actor changed after the sequence number,
+    # so repeated updates of an actor are compacted into a single event
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    cur.execute("SELECT c.seq, c.actor_id, c.op, a.* FROM ActorChanges c \
+                LEFT JOIN Actors a ON a.id = c.actor_id \
+                WHERE c.seq > ? \
+                AND c.seq = (SELECT MAX(seq) FROM ActorChanges WHERE actor_id = c.actor_id) \
+                ORDER BY c.seq LIMIT ?",\
+                (since, limit))
+    rows = cur.fetchall()
+    cur.close()
+    
+    # Converting rows into list of compact events
+    lst_changes = []
+    for row in rows:
+        if row['op'] == 'upsert' and row['id'] is not None:
+            change = {"seq": row['seq'],
+                      "op": "upsert",
+                      "id": row['actor_id'],
+                      "last-update": row['lastUpdate'],
+                      "name": row['name'],
+                      "country": row['country'],
+                      "birthday": row['birthday'],
+                      "deathday": row['deathday'],
+                      "gender": row['gender'],
+                      "shows": get_shows_by_id(row['actor_id'], conn)
+                      }
+        else:
+            change = {"seq": row['seq'],
+                      "op": "delete",
+                      "id": row['actor_id']
+                      }
+        lst_changes.append(change)
+    
+    return lst_changes
+
+
+def get_current_seq(conn):
+    # Getting the sequence number of the latest change (0 if there is none)
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(seq), 0) FROM ActorChanges")
+    current_seq = cur.fetchone()[0]
+    cur.close()
+    return current_seq
+
+
 def check_existed_actor(actor_name, conn):
     cur = conn.cursor()
     
@@ -114,10 +177,10 @@ def get_shows_by_id(actor_id, conn):
 def update_actor_by_id(actor_id, new_info, new_shows, conn):
     try:
         cur = conn.cursor()
-        cur.execute("UPDATE Actors SET name = ?, tvmazeId = ?, country = ?, birthday = ?, deathday = ?, gender = ? \
+        cur.execute("UPDATE Actors SET name = ?, tvmazeId = ?, country = ?, birthday = ?, deathday = ?, gender = ?, lastUpdate = ? \
                     WHERE id = ?",\
                     (new_info['name'], new_info['id'], new_info['country'], new_info['birthday'],\
-                     new_info['deathday'], new_info['gender'], actor_id,))
+                     new_info['deathday'], new_info['gender'], new_info['lastUpdate'], actor_id,))
         
         # Checking if the shows are changed
         if new_shows.sort() != get_shows_by_id(actor_id, conn).sort():
@@ -130,7 +193,9 @@ def update_actor_by_id(actor_id, new_info, new_shows, conn):
                 for show in new_shows:
                     cur.execute("INSERT OR IGNORE INTO ActorInShows (actor_id, showName) VALUES (?, ?)",\
                                 (actor_id, show))
-                    
+        
+        # Logging the update in the change feed
+        record_change(actor_id, 'upsert', cur)
         conn.commit()
         
     except sqlite3.Error as err:
@@ -141,16 +206,60 @@ def update_actor_by_id(actor_id, new_info, new_shows, conn):
         cur.close()    
 
     
-def get_all_actors(lst_filters, lst_orders, conn):
+def build_actor_conditions(input_facets):
+    # Compiling the row filters into a parameterised WHERE clause
+    conditions = []
+    params = []
+    
+    if input_facets.get('country') is not None:
+        conditions.append('country = ? COLLATE NOCASE')
+        params.append(input_facets['country'])
+        
+    if input_facets.get('gender') is not None:
+        conditions.append('gender = ? COLLATE NOCASE')
+        params.append(input_facets['gender'])
+    
+    # Birthdays are 'YYYY-MM-DD' text, so a year range is a text range
+    # (which also excludes unknown 'NULL' birthdays)
+    born_from = input_facets.get('born_from')
+    born_to = input_facets.get('born_to')
+    if born_from is not None or born_to is not None:
+        born_from = born_from if born_from is not None else 0
+        born_to = born_to if born_to is not None else 9999
+        conditions.append('birthday BETWEEN ? AND ?')
+        params.extend([f'{born_from:04d}-01-01', f'{born_to:04d}-12-31'])
+        
+    if input_facets.get('life_status') == 'alive':
+        conditions.append("deathday = 'NULL'")
+    elif input_facets.get('life_status') == 'deceased':
+        conditions.append("deathday <> 'NULL'")
+    
+    where_str = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return where_str, params
+
+
+def count_actors(where_str, params, conn):
+    cur = conn.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM Actors {where_str}", params)
+    total = cur.fetchone()[0]
+    cur.close()
+    return total
+
+
+def get_all_actors(lst_filters, lst_orders, where_str, params, limit, offset, conn):
+    # Mapping API attribute names to column names
+    column_names = {'last-update': 'lastUpdate'}
+    
     modified_filters = [item for item in lst_filters if item != 'shows']
-    filter_str = ', '.join(str(item) for item in modified_filters)
+    filter_str = ', '.join(column_names.get(item, item) for item in modified_filters)
     order_str = ', '.join(str(item) for item in lst_orders)
     
     lst_actors = []
     try:
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        cur.execute(f"SELECT {filter_str} FROM Actors ORDER BY {order_str}")
+        cur.execute(f"SELECT {filter_str} FROM Actors {where_str} ORDER BY {order_str} LIMIT ? OFFSET ?",\
+                    params + [limit, offset])
         rows = cur.fetchall()
     
         # Converting rows into list of actors
@@ -173,69 +282,76 @@ def get_all_actors(lst_filters, lst_orders, conn):
 # ----- API HELPER FUNCTIONS ------
 def add_new_actor(input_name):
     # Pre-processing input name
-    junk_characters = re.compile(r'[^a-zA-Z]')
-    name = re.sub(junk_characters, ' ', input_name).lower()
-    
-    # Retrieving actor information from TV Maze
-    request_url = f'https://api.tvmaze.com/search/people?q={name}'
-    tvm_response = requests.get(request_url).json()
+    name = normalise_name(input_name)
     
-    if len(tvm_response) == 0:
-        return {'message': f'Actor {input_name} does not exist'}, 404
+    # Resolving actor from the local TV Maze index, falling back to TV Maze on a miss
+    local_match = lookup_person(name)
+    if local_match:
+        actor_rawinfo, show_record = local_match
+    else:
+        # Retrieving actor information from TV Maze
+        request_url = f'https://api.tvmaze.com/search/people?q={name}'
+        tvm_response = requests.get(request_url).json()
+        
+        if len(tvm_response) == 0:
+            return {'message': f'Actor {input_name} does not exist'}, 404
+        
+        elif tvm_response[0]['person']['name'].lower() != name:
+            return {'message': f'Actor {input_name} does not exist'}, 404
+        
+        actor_rawinfo = tvm_response[0]['person']
+        show_record = None
     
-    elif tvm_response[0]['person']['name'].lower() != name:
-        return {'message': f'Actor {input_name} does not exist'}, 404
+    # Checking if actor exists in the db
+    tvm_actorid = actor_rawinfo['id']
+    conn = connect_db()
     
+    # Checking if actor already exists in the Database
+    if check_existed_actor(name, conn):
+        return {'message': f'Actor {input_name} already exists'}, 400
     else:
-        # Checking if actor exists in the db
-        actor_rawinfo = tvm_response[0]['person']
-        tvm_actorid = actor_rawinfo['id']
-        conn = connect_db()
-        
-        # Checking if actor already exists in the Database
-        if check_existed_actor(name, conn):
-            return {'message': f'Actor {input_name} already exists'}, 400
-        else:
-            # Getting a dictionary of record with keys are Actors table schema
-            actor_record ={key:value for key, value in actor_rawinfo.items() \
-                           if key in {'name', 'id', 'country', 'birthday', 'deathday', 'gender'}}
-                
-            now = datetime.now().strftime('%Y-%m-%d-%H:%M:%S')   
-            actor_record['lastUpdate'] = now
+        # Getting a dictionary of record with keys are Actors table schema
+        actor_record ={key:value for key, value in actor_rawinfo.items() \
+                       if key in {'name', 'id', 'country', 'birthday', 'deathday', 'gender'}}
             
-            for key in actor_record.keys():
-                # Updating None Type values in actor_record to string 'NULL'
-                if actor_record[key] == None:
-                    actor_record[key] = 'NULL'
-                # Updating country values to country_name
-                elif actor_record[key] != None and key == 'country':
-                    country_name = actor_record['country']['name']
-                    actor_record[key] = country_name   
-            
-            # Getting a list of actor's shows from TV Maze using the tvm_actorid
+        now = datetime.now().strftime('%Y-%m-%d-%H:%M:%S')   
+        actor_record['lastUpdate'] = now
+        
+        for key in actor_record.keys():
+            # Updating None Type values in actor_record to string 'NULL'
+            if actor_record[key] == None:
+                actor_record[key] = 'NULL'
+            # Updating country values to country_name
+            elif actor_record[key] != None and key == 'country':
+                country_name = actor_record['country']['name']
+                actor_record[key] = country_name   
+        
+        # Getting a list of actor's shows from TV Maze using the tvm_actorid
+        # (unless they were already resolved from the local index)
+        if show_record is None:
             show_record = []
             shows_request_url = f'https://api.tvmaze.com/people/{tvm_actorid}/castcredits?embed=show'
             tvm_shows_response = requests.get(shows_request_url).json()
             for show in tvm_shows_response:
                 show_name = show['_embedded']['show']['name']
                 show_record.append(show_name)
-            
-            # Adding records into Database
-            actor_id = add_actor(actor_record, show_record, conn)
-            conn.close()
-            
-            # Creating self link to actor
-            actor_link = {"self": {"href": f"http://{request.host}/actors/{actor_id}"}}
-            
-            # Creating an API response if adding actor is successful
-            api_response = {"id": actor_id,
-                            "last-update": now,
-                            "_links": actor_link
-                            }
-            return api_response, 201
         
+        # Adding records into Database
+        actor_id = add_actor(actor_record, show_record, conn)
+        conn.close()
+        
+        # Creating self link to actor
+        actor_link = {"self": {"href": f"http://{request.host}/actors/{actor_id}"}}
         
-def get_all_actors_paginated(input_order, input_page, input_size, input_filter):
+        # Creating an API response if adding actor is successful
+        api_response = {"id": actor_id,
+                        "last-update": now,
+                        "_links": actor_link
+                        }
+        return api_response, 201
+    
+    
+def get_all_actors_paginated(input_order, input_page, input_size, input_filter, input_facets):
     order_options = ['id', 'name', 'country', 'birthday', 'deathday', 'last-update']
     filter_options = ['id', 'name', 'country', 'birthday', 'deathday', 'last-update', 'shows']
     
@@ -245,18 +361,33 @@ def get_all_actors_paginated(input_order, input_page, input_size, input_filter):
     elif input_size < 1:
         return {'message': f'Size {input_page} is invalid'}, 400
     
+    born_from = input_facets.get('born_from')
+    born_to = input_facets.get('born_to')
+    # Years are compared as 'YYYY' text, so they must have four digits
+    for year in [born_from, born_to]:
+        if year is not None and (year < 0 or year > 9999):
+            return {'message': f'Birth year {year} is invalid (Allowed range is 0-9999)'}, 400
+        
+    if born_from is not None and born_to is not None and born_from > born_to:
+        return {'message': f'Birth year range {born_from}-{born_to} is invalid'}, 400
+    
     modified_order = []
     for item in input_order:
         if item[0] not in ['+', '-'] or item[1:] not in order_options:
             return {'message': f'Order criteria {item} is invalid'}, 400
         
+        column = 'lastUpdate' if item[1:] == 'last-update' else item[1:]
         if item.startswith('+'):
-            modified_item = f'{item[1:]} ASC'
+            modified_item = f'{column} ASC'
             modified_order.append(modified_item)
             
         if item.startswith('-'):
-            modified_item = f'{item[1:]} DESC'
+            modified_item = f'{column} DESC'
             modified_order.append(modified_item)
+    
+    # Breaking ties by id so that pages do not overlap
+    if not any(item[1:] == 'id' for item in input_order):
+        modified_order.append('id ASC')
         
     for item in input_filter:
         if item not in filter_options:
@@ -276,25 +407,35 @@ def get_all_actors_paginated(input_order, input_page, input_size, input_filter):
         return {'message': 'There is no actor in the database'}, 404
         
     else:
-        actors_list = get_all_actors(input_filter, modified_order, conn)
-        conn.close()
+        # Counting the matching actors, so that only the query page is fetched
+        where_str, params = build_actor_conditions(input_facets)
+        nb_of_actors = count_actors(where_str, params, conn)
+        
+        if nb_of_actors == 0:
+            conn.close()
+            return {'message': 'There is no actor matching the filters'}, 404
         
-        nb_of_page = ceil(len(actors_list)/int(input_size))
+        nb_of_page = ceil(nb_of_actors/int(input_size))
         
         if input_page > nb_of_page:
+            conn.close()
             return {'message': f'Page {input_page} is out of range (Maximum page number is {nb_of_page})'}, 400
         
         else:
-            start_index = (input_page - 1)*input_size
-            end_index = (start_index + input_size) if input_page*input_size < len(actors_list) else len(actors_list)
+            offset = (input_page - 1)*input_size
+            output_actors = get_all_actors(input_filter, modified_order, where_str, params, input_size, offset, conn)
+            conn.close()
             
-            output_actors = actors_list[start_index : end_index]
             output_order = ','.join(input_order)
             output_filter = ','.join(input_filter)
             
-            self_link = {"href": f"http://{request.host}/actors?order={output_order}&page={input_page}&size={input_size}&filter={output_filter}"}
-            previous_link = {"href": f"http://{request.host}/actors?order={output_order}&page={input_page-1}&size={input_size}&filter={output_filter}"}
-            next_link = {"href": f"http://{request.host}/actors?order={output_order}&page={input_page+1}&size={input_size}&filter={output_filter}"}
+            # Carrying the row filters over to the page links
+            facets = {key: value for key, value in input_facets.items() if value is not None}
+            output_facets = f'&{urlencode(facets)}' if facets else ''
+            
+            self_link = {"href": f"http://{request.host}/actors?order={output_order}&page={input_page}&size={input_size}&filter={output_filter}{output_facets}"}
+            previous_link = {"href": f"http://{request.host}/actors?order={output_order}&page={input_page-1}&size={input_size}&filter={output_filter}{output_facets}"}
+            next_link = {"href": f"http://{request.host}/actors?order={output_order}&page={input_page+1}&size={input_size}&filter={output_filter}{output_facets}"}
             
             # Checking if the query page is the only page
             if input_page == 1 and input_page == nb_of_page:
@@ -398,6 +539,7 @@ def delete_actor(id):
         cur = conn.cursor()
         cur.execute("DELETE FROM Actors WHERE id = ?", (id,))
         cur.execute("DELETE FROM ActorInShows WHERE actor_id = ?", (id,))
+        record_change(id, 'delete', cur)
         conn.commit()
         cur.close()
         conn.close()
@@ -549,30 +691,67 @@ def get_stat_summary(input_format, input_attributes):
             return api_response, 200
                 
         else:
-            plt.figure(figsize = (20, 15))
+            # Drawing on a figure owned by this request (not the global pyplot state),
+            # so that concurrent requests in threads or workers do not interfere
+            fig = Figure(figsize = (20, 15))
             nb_of_plots = len(output_dict) + 1
             
             # Plotting actors by update status
-            plt.subplot(1, nb_of_plots, 1)
+            ax = fig.add_subplot(1, nb_of_plots, 1)
             labels = ['Not updated', 'Updated last 24 hours']
             values = [total_actors - updates_last_24, updates_last_24]
-            plt.pie(x = values, labels = labels, colors = plt.cm.Accent.colors, autopct='%.1f%%', startangle = 90)
-            # plt.legend(loc='lower left', fontsize=10)#, bbox_to_anchor=(0.5, -0.1))
-            plt.title('Actors\nBy Update Status', color = 'b', fontsize = 12, fontweight='bold')
+            ax.pie(x = values, labels = labels, colors = cm.Accent.colors, autopct='%.1f%%', startangle = 90)
+            # ax.legend(loc='lower left', fontsize=10)#, bbox_to_anchor=(0.5, -0.1))
+            ax.set_title('Actors\nBy Update Status', color = 'b', fontsize = 12, fontweight='bold')
             
             # Plotting actors by input attributes
             plot_count = 1
             for key, value in output_dict.items():
-                plt.subplot(1, nb_of_plots, plot_count + 1)
+                ax = fig.add_subplot(1, nb_of_plots, plot_count + 1)
                 labels = list(value.keys())
                 values = list(value.values())
-                plt.pie(x = values, labels = labels, colors = plt.cm.Accent.colors, autopct='%.1f%%', startangle = 90)
-                # plt.legend(loc='lower left', fontsize=10)#, bbox_to_anchor=(0.5, -0.1))
-                plt.title(f'Actors\nPercentage By {key}', color = 'b', fontsize = 12, fontweight='bold')
+                ax.pie(x = values, labels = labels, colors = cm.Accent.colors, autopct='%.1f%%', startangle = 90)
+                # ax.legend(loc='lower left', fontsize=10)#, bbox_to_anchor=(0.5, -0.1))
+                ax.set_title(f'Actors\nPercentage By {key}', color = 'b', fontsize = 12, fontweight='bold')
                 plot_count += 1
                 
-            plt.tight_layout()
-            image_name = 'z5335667_q6.jpg'
-            plt.savefig(image_name)
+            fig.tight_layout()
+            
+            # Rendering into memory instead of a shared file on disk
+            image = BytesIO()
+            fig.savefig(image, format = 'jpg')
+            image.seek(0)
             
-            return send_file(image_name, mimetype='image/jpg')
\ No newline at end of file
+            return send_file(image, mimetype='image/jpg')
+
+
+def get_changes(input_since, input_limit):
+    # Checking query parameters
+    if input_since < 0:
+        return {'message': f'Sequence number {input_since} is invalid'}, 400
+    elif input_limit < 1 or input_limit > 1000:
+        return {'message': f'Limit {input_limit} is invalid (Allowed range is 1-1000)'}, 400
+    
+    conn = connect_db()
+    # Fetching one extra event to know whether another page exists
+    changes_list = get_changes_since(input_since, input_limit + 1, conn)
+    current_seq = get_current_seq(conn)
+    conn.close()
+    
+    has_more = len(changes_list) > input_limit
+    output_changes = changes_list[:input_limit]
+    
+    # The last returned sequence number is the cursor for the next sync
+    last_seq = output_changes[-1]['seq'] if output_changes else input_since
+    
+    output_links = {"self": {"href": f"http://{request.host}/actors/changes?since={input_since}&limit={input_limit}"}}
+    if has_more:
+        output_links["next"] = {"href": f"http://{request.host}/actors/changes?since={last_seq}&limit={input_limit}"}
+    
+    # current-seq can be paired with a full scan of /actors to start syncing
+    api_response = {"since": input_since,
+                    "last-seq": last_seq,
+                    "current-seq": current_seq,
+                    "changes": output_changes,
+                    "_links": output_links}
+    return api_response, 200
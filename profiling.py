@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Python 3.8.5
+"""
+
+On-demand cProfile profiling of API requests
+
+A request is profiled when any of these app config settings selects it:
+    PROFILE_ENABLED       Profile every request (default: False)
+    PROFILE_SAMPLE_RATE   Fraction of requests to profile, 0.0-1.0 (default: 0.0)
+    PROFILE_TOKEN         Profile requests sent with the header X-Profile: <token>
+                          (default: None, header ignored)
+Each profile is written to PROFILE_DIR (default: profiles) as a .prof file
+named <endpoint>.<method>.<timestamp>.<pid>.prof, which can be read with
+pstats, snakeviz or flameprof (flamegraph).
+
+"""
+import os
+import hmac
+import random
+import cProfile
+from datetime import datetime
+from flask import request, current_app, g
+
+
+# ----- PROFILING HELPER FUNCTIONS ------
+def profiling_requested(config):
+    if config.get('PROFILE_ENABLED', False):
+        return True
+
+    sample_rate = config.get('PROFILE_SAMPLE_RATE', 0.0)
+    if sample_rate > 0 and random.random() < sample_rate:
+        return True
+
+    token = config.get('PROFILE_TOKEN')
+    if token:
+        header = request.headers.get('X-Profile')
+        # Comparing bytes, as compare_digest rejects non-ASCII str and the
+        # header is client controlled (decoded by Werkzeug as latin-1)
+        return header is not None and \
+            hmac.compare_digest(header.encode('latin-1'), token.encode('utf-8'))
+
+    return False
+
+
+def start_profiling():
+    if not profiling_requested(current_app.config):
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already running (e.g. for a concurrent request)
+        return
+    g.profiler = profiler
+
+
+def stop_profiling(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+
+    profiler.disable()
+
+    # Keying the output by route and time
+    profile_dir = current_app.config.get('PROFILE_DIR', 'profiles')
+    os.makedirs(profile_dir, exist_ok = True)
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    file_name = f'{request.endpoint}.{request.method}.{timestamp}.{os.getpid()}.prof'
+    profiler.dump_stats(os.path.join(profile_dir, file_name))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Python 3.8.5
+"""
+
+Production entry point running the API on a pre-fork Gunicorn server
+
+The app is loaded once in the master process and shared by the forked
+workers. Usage:
+    $ python3 server.py --workers 4 --threads 2 --bind 0.0.0.0:5000
+
+"""
+import os
+import gc
+import argparse
+import multiprocessing
+from gunicorn.app.base import BaseApplication
+from app import app
+from actors_db import create_tables
+import tvmaze_index
+
+
+# ----- SERVER HOOKS ------
+def on_starting(server):
+    # Setting up the schema exactly once, in the master before any fork
+    create_tables()
+
+    # Preloading the TV Maze index, then freezing it out of the garbage
+    # collector so that collections in the workers do not write to (and copy)
+    # all of its memory pages; only the records a worker looks up get copied
+    tvmaze_index.get_index()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # connect_db opens a new SQLite connection per call and none is kept open
+    # in the master, so no connection is inherited across the fork.
+    # Locks may have been copied in a held state, so they are recreated.
+    tvmaze_index.reset_after_fork()
+
+
+class ActorsServer(BaseApplication):
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description = 'Run the Actors API on a pre-fork server')
+    arg_parser.add_argument('--bind', default = os.environ.get('BIND', '0.0.0.0:5000'),
+                            help = 'Address to listen on (default: 0.0.0.0:5000)')
+    arg_parser.add_argument('--workers', type = int,
+                            default = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count())),
+                            help = 'Number of worker processes (default: number of cores)')
+    arg_parser.add_argument('--threads', type = int, default = int(os.environ.get('THREADS', 1)),
+                            help = 'Number of threads per worker (default: 1)')
+    args = arg_parser.parse_args()
+
+    options = {'bind': args.bind,
+               'workers': args.workers,
+               'threads': args.threads,
+               'preload_app': True,
+               'on_starting': on_starting,
+               'post_fork': post_fork
+               }
+    ActorsServer(app, options).run()
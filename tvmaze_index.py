@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Python 3.8.5
+"""
+
+Local index of TV Maze people built from a dump file, so that actors can be
+resolved without a network round trip to https://api.tvmaze.com
+
+The dump file holds one JSON object per line: a TV Maze person record (as
+returned by /people/{id}) with its cast credits embedded in the same form as
+/people/{id}/castcredits?embed=show, i.e.
+    {"id": 1, "name": "...", ..., "_embedded": {"castcredits": [{"_embedded": {"show": {"name": "..."}}}]}}
+
+"""
+import os
+import re
+import sys
+import json
+import threading
+from timeit import default_timer
+
+
+PEOPLE_DUMP = 'tvmaze_people.jsonl'
+
+junk_characters = re.compile(r'[^a-zA-Z]')
+
+# Cached index: normalised name -> (person record, list of show names)
+_index = None
+_index_lock = threading.Lock()
+
+
+# ----- INDEX HELPER FUNCTIONS ------
+def normalise_name(input_name):
+    # Replacing non-alphabetic characters with spaces and lower-casing
+    return re.sub(junk_characters, ' ', input_name).lower()
+
+
+def build_index(dump_path):
+    index = {}
+    with open(dump_path, encoding = 'utf-8') as dump_file:
+        for line in dump_file:
+            line = line.strip()
+            if not line:
+                continue
+
+            person = json.loads(line)
+            castcredits = person.pop('_embedded', {}).get('castcredits', [])
+            shows = [credit['_embedded']['show']['name'] for credit in castcredits]
+
+            # Keeping the first person found for a name, like the upstream search
+            key = normalise_name(person['name'])
+            if key not in index:
+                index[key] = (person, shows)
+
+    return index
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            # Checking again in case another thread built the index meanwhile
+            if _index is None:
+                if os.path.exists(PEOPLE_DUMP):
+                    _index = build_index(PEOPLE_DUMP)
+                else:
+                    _index = {}
+    return _index
+
+
+def reset_after_fork():
+    # Recreating the lock in a forked child, where it may have been copied
+    # while held; the index itself is read-only and stays shared
+    global _index_lock
+    _index_lock = threading.Lock()
+
+
+def lookup_person(name):
+    # Returns (person record, list of show names), or None if not indexed
+    return get_index().get(name)
+
+
+# ----- BENCHMARK ------
+if __name__ == '__main__':
+    dump_path = sys.argv[1] if len(sys.argv) > 1 else PEOPLE_DUMP
+
+    start = default_timer()
+    bench_index = build_index(dump_path)
+    build_time = default_timer() - start
+    print(f'Built index of {len(bench_index)} people in {build_time:.3f} s')
+
+    if bench_index:
+        names = list(bench_index.keys())
+        nb_lookups = 100000
+        start = default_timer()
+        for i in range(nb_lookups):
+            bench_index.get(names[i % len(names)])
+        lookup_time = default_timer() - start
+        print(f'Average lookup latency: {lookup_time / nb_lookups * 1e6:.3f} us')